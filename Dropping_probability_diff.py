@@ -1,17 +1,15 @@
-import simpy
-import random
-import matplotlib.pyplot as plt
+import argparse
 import numpy as np
-import pandas as pd
-
-from Simulation import Call
+from fast_sim import Model, run_sweep, probabilities
+from analytic import offered_load, erlang_b
 
 # Variable, for lambda in (40, 50), the blocking probability 
 # is roughly 20% when handoff traffic is about 50% of total traffic
 LAMBD = 50
+# handoff traffic ratios to sweep, 0.01 to 0.99 in steps of 0.01
+HANDOFF_RANGE = np.linspace(0.01, 0.99, 99)
 
 # Constant
-MEAN_MESSAGE_DURATION = 3
 RANDOM_SEED = 1
 PRIORITY_1_RATIO = 0.5
 NEW_CALL_SERVICE_RATE = 60/60
@@ -23,38 +21,54 @@ N_CALLS = 10000
 N_Channels = 30
 Q1_SIZE = 5
 Q2_SIZE = 5
-TRACING = False
 
 
-def main():
+def main(plot=True, out=None):
+    """
+    Run the sweep, out: save the result table to a .csv file, or .parquet through pandas(needs pyarrow),
+    plot: show the figure, pass plot=False to only time the sweep or save the result.
+    """
 
-    handoff_traffic_range = np.array(np.arange(0.01, 1, 0.01))
+    handoff_traffic_range = HANDOFF_RANGE
 
-    plot_data = {'Ph_d': [], 'Ph_f': [], 'Pb_d': [], 'Pb_f': [], 'ratio_d': [], 'ratio_f': []}
-    for i in handoff_traffic_range:
-        Simulation(i, LAMBD, plot_data, 0)  # dynamic
-        Simulation(i, LAMBD, plot_data, 1)  # FCFS
+    plot_data = {k: np.empty(handoff_traffic_range.size, dtype=np.float64) for k in ('Ph_d', 'Ph_f', 'Pb_d', 'Pb_f', 'ratio_d', 'ratio_f')}
+    Pb, Ph = Simulation(handoff_traffic_range, LAMBD)
+    for queue_type, suffix in ((0, 'd'), (1, 'f')):  # 0: dynamic, 1: FCFS
+        plot_data['ratio_' + suffix][:] = handoff_traffic_range
+        plot_data['Pb_' + suffix][:], plot_data['Ph_' + suffix][:] = Pb[:, queue_type], Ph[:, queue_type]
     
-    diff = []
-    for i in range(len(plot_data['Ph_d'])):
-        diff.append(plot_data['Ph_f'][i] - plot_data['Ph_d'][i])
+    diff = plot_data['Ph_f'] - plot_data['Ph_d']
 
     # simulation result data
-    df = pd.DataFrame({
+    result = {
         'Handoff traffic ratio': plot_data['ratio_d'],
         'Blocking probability(FCFS)': plot_data['Pb_f'],
         'Blocking probability(dynamic queue)': plot_data['Pb_d'],
         'Drop probability for handoff call(FCFS queue)': plot_data['Ph_f'],
         'Drop probability for handoff call(dynamic queue)': plot_data['Ph_d'],
-        'Dropping probability difference': diff
-    })
+        'Dropping probability difference': diff,
+        'Erlang-B blocking probability(no queue)': erlang_b(N_Channels, offered_load(LAMBD, plot_data['ratio_d'], FastModel())),
+    }
+
+    if out is not None:
+        if out.endswith('.parquet'):
+            import pandas as pd     # only needed for parquet
+            pd.DataFrame(result).to_parquet(out)
+        else:
+            np.savetxt(out, np.column_stack(list(result.values())), fmt='%s', delimiter=',',
+                       header=','.join(result), comments='')
+    if plot:
+        Plot(result)
 
-    
-    plt.plot('Handoff traffic ratio', 'Drop probability for handoff call(dynamic queue)',data=df, marker='.', color='red', linewidth=2)
-    plt.plot('Handoff traffic ratio', 'Drop probability for handoff call(FCFS queue)',data=df, marker='.', color='orange', linewidth=2)
-    plt.plot('Handoff traffic ratio', 'Blocking probability(FCFS)',data=df, marker='.', color='skyblue', linewidth=2)
-    plt.plot('Handoff traffic ratio', 'Blocking probability(dynamic queue)',data=df, marker='.', color='blue', linewidth=2)
-    plt.plot('Handoff traffic ratio', 'Dropping probability difference',data=df, marker='.', color='green', linewidth=2)
+
+def Plot(result):
+    import matplotlib.pyplot as plt     # only paid for when plotting
+    x = result['Handoff traffic ratio']
+    for name, color in (('Drop probability for handoff call(dynamic queue)', 'red'), ('Drop probability for handoff call(FCFS queue)', 'orange'),
+                        ('Blocking probability(FCFS)', 'skyblue'), ('Blocking probability(dynamic queue)', 'blue'),
+                        ('Dropping probability difference', 'green')):
+        plt.plot(x, result[name], label=name, marker='.', color=color, linewidth=2)
+    plt.plot(x, result['Erlang-B blocking probability(no queue)'], label='Erlang-B blocking probability(no queue)', marker='', color='gray', linestyle='--', linewidth=1)
 
     plt.xlabel('handoff traffic ratio')
     plt.ylabel('probability')
@@ -62,55 +76,30 @@ def main():
     plt.show()
 
 
-def Simulation(handoff_ratio, lambd, plot_data, queue_type):
-
-    system_performace_data = {'N_call': 0, 'H_call': 0, 'BN_call': 0, 'BH_call': 0,
-                            'P1_call': 0, 'P2_call': 0, 'BP1_call': 0, 'BP2_call': 0, 'DP1_call': 0, 'DP2_call': 0}
-
-    random.seed(RANDOM_SEED)
-    env = simpy.Environment()
-    BST = simpy.PriorityResource(env, capacity=N_Channels)
-    callSource = CallSource(env, N_CALLS, lambd, handoff_ratio,PRIORITY_1_RATIO, BST, system_performace_data, queue_type)
-    env.process(callSource)
-    env.run()
-
-    if queue_type == 0:
-        plot_data["ratio_d"].append(handoff_ratio)
-        plot_data['Pb_d'].append((system_performace_data['BN_call'] + system_performace_data['BP1_call'] + system_performace_data['BP2_call'])/ N_CALLS)
-        plot_data['Ph_d'].append(PRIORITY_1_RATIO * (system_performace_data['DP1_call'])/system_performace_data['H_call'] + (
-            1 - PRIORITY_1_RATIO) * (system_performace_data['DP2_call'])/system_performace_data['H_call'])
-    elif queue_type == 1:
-        plot_data["ratio_f"].append(handoff_ratio)
-        plot_data['Pb_f'].append((system_performace_data['BN_call'] + system_performace_data['BP1_call'] + system_performace_data['BP2_call'])/ N_CALLS)
-        plot_data['Ph_f'].append(PRIORITY_1_RATIO * (system_performace_data['DP1_call'])/system_performace_data['H_call'] + (
-            1 - PRIORITY_1_RATIO) * (system_performace_data['DP2_call'])/system_performace_data['H_call'])
-
-# Model components
-def CallSource(env, N_CALLS, LAMBD, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO, BST, system_performace_data, queue_type):
-    """ 
-    Generates a sequence of new calls depends on HANDOFF_TRAFFIC_RATIO & PRIORITY_1_RATIO,
-    In this case, HANDOFF_TRAFFIC_RATIO = 1/2, and PRIORITY_1_RATIO = 1/2, which means the handoff traffic is roughly  
-    50% of the total in-comming call traffic, and among the total handoff traffic, calls that have priority 1 is roughly 50%. 
+def Simulation(handoff_ratios, lambd):
     """
-    for i in range(N_CALLS):
-        p1 = random.random()
-        if p1 > HANDOFF_TRAFFIC_RATIO:
-            call = Call(
-                env, BST, 0, f"new call       , ID = {i}", system_performace_data, queue_type)
-            env.process(call)
-        else:
-            p2 = random.random()
-            if p2 > PRIORITY_1_RATIO:
-                call = Call(
-                    env, BST, 2, f"Priority 2 call, ID = {i}", system_performace_data, queue_type)
-                env.process(call)
-            else:
-                call = Call(
-                    env, BST, 1, f"Priority 1 call, ID = {i}", system_performace_data, queue_type)
-                env.process(call)
-        # t is the interarrival time, given the arrival rate is LAMBD
-        t = random.expovariate(LAMBD)
-        yield env.timeout(t)
+    Simulate every point of handoff_ratios in parallel, return the (blocking, dropping) probability arrays
+    with one column per queue scheme. Each handoff_ratio gets its own seed, results stay reproducible without
+    every point replaying the same random stream, and both schemes of a point share it so the dropping
+    probability difference is not buried in sampling noise.
+    """
+
+    handoff_ratios = np.asarray(handoff_ratios, dtype=np.float64)
+    # one well mixed 32 bit seed per point, spawned from RANDOM_SEED by SeedSequence
+    seeds = np.random.SeedSequence(RANDOM_SEED).generate_state(handoff_ratios.size).astype(np.int64)
+    model = FastModel()
+    stats = run_sweep(handoff_ratios, np.full(handoff_ratios.size, float(lambd)), seeds, model)
+    return probabilities(stats, model)
+
+def FastModel():
+    # built on every call, so the global parameters above can still be changed at run time
+    return Model(N_CALLS, N_Channels, Q1_SIZE, Q2_SIZE, PRIORITY_1_RATIO, NEW_CALL_SERVICE_RATE, HANDOFF_CALL_SERVICE_RATE,
+                 P1CALL_DROP_RATE, P2CALL_DROP_RATE, TRANSITION_RATE)
+
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Dropping probability difference between the FCFS & dynamic queue scheme.')
+    parser.add_argument('--no-plot', action='store_true', help='do not show the figure')
+    parser.add_argument('--out', help='save the result to a .parquet or .csv file')
+    args = parser.parse_args()
+    main(plot=not args.no_plot, out=args.out)
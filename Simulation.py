@@ -4,10 +4,14 @@ Paper link: https://ieeexplore.ieee.org/document/936959
 """
 
 import simpy
-import random
-import matplotlib.pyplot as plt
+import gc
+import hashlib
+import inspect
+import itertools
+from collections import deque
 import numpy as np
-import pandas as pd
+from analytic import offered_load, erlang_b
+from fast_sim import Model, run_sweep, probabilities, N_STATS, N_CALL, H_CALL, BN_CALL, BP1_CALL, BP2_CALL, P1_CALL, P2_CALL, DP1_CALL, DP2_CALL
 
 
 """
@@ -16,7 +20,6 @@ Parameter Value used to plot Fig.3 & 4 in paper(only listed the difference):
 P1CALL_DROP_RATE =          60/7.5      60/12.5
 P2CALL_DROP_RATE =          60/12.5     60/17.5
 """
-MEAN_MESSAGE_DURATION = 3
 RANDOM_SEED = 1
 HANDOFF_TRAFFIC_RATIO = 0.5
 PRIORITY_1_RATIO = 0.5
@@ -30,267 +33,410 @@ N_Channels = 30
 Q1_SIZE = 5
 Q2_SIZE = 5
 TRACING = False
+SIMPY_REFERENCE = False       # True: run the sweep with the SimPy model instead of the numba one in fast_sim.py
+REPLICATES = 8                # independent replicates pooled per point of the numba sweep(the SimPy one runs a single replicate)
+SIM_CACHE = '.sim_cache'      # on-disk cache of the SimPy reference results, None to disable
 
 def main():
 
     lambda_range = np.array(np.arange(0.01, 80, 1))
 
-    plot_data = {'Pb_d': [], 'Ph_d': [], 'Pb_f': [], 'Ph_f': [], 'Lambda_d': [], 'Lambda_f': []}
-    for i in lambda_range:
-        Simulation(i, plot_data, 0) # dynamic queue scheme
-        Simulation(i, plot_data, 1) # FCFS queue scheme
+    # one slot per lambda, filled in place below
+    plot_data = {key: np.empty(lambda_range.size) for key in ('Pb_d', 'Ph_d', 'Pb_f', 'Ph_f', 'Lambda_d', 'Lambda_f')}
+    points = list(itertools.product(lambda_range, (0, 1)))    # 0: dynamic queue scheme, 1: FCFS queue scheme
+    if SIMPY_REFERENCE:
+        from joblib import Memory, Parallel, delayed     # only needed for the SimPy sweep
+        # every point is an independent simulation, joblib keeps one warm worker process per core for the whole sweep
+        # already simulated points are loaded from SIM_CACHE instead
+        cached = Memory(SIM_CACHE, verbose=0).cache(CachedSimulation)
+        model, code = FastModel(), source_hash()
+        results = Parallel(n_jobs=-1)(delayed(cached)(i, queue_type, HANDOFF_TRAFFIC_RATIO, model, RANDOM_SEED, code)
+                                      for i, queue_type in points)
+    else:
+        # all points at once, run_sweep spreads them over every core with numba.prange,
+        # the (lambda, queue_type) rows come out in the order of points
+        Pb, Ph = FastSimulation(lambda_range)
+        results = zip(Pb.ravel(), Ph.ravel())
+    for k, ((i, queue_type), (Pb, Ph)) in enumerate(zip(points, results)):
+        suffix = '_d' if queue_type == 0 else '_f'
+        # points go lambda by lambda, the two queue schemes of lambda_range[k // 2] share slot k // 2
+        plot_data['Lambda' + suffix][k // 2] = i
+        plot_data['Pb' + suffix][k // 2] = Pb
+        plot_data['Ph' + suffix][k // 2] = Ph
     
-    df = pd.DataFrame({
-        'Offered_load': plot_data['Lambda_d'],
-        'Block probability for new call(dynamic queue)': plot_data['Pb_d'],
-        'Drop probability for handoff call(dynamic queue)': plot_data['Ph_d'],
-        'Block probability for new call(FCFS queue)': plot_data['Pb_f'],
-        'Drop probability for handoff call(FCFS queue)': plot_data['Ph_f'],
-    })
-
-    plt.plot('Offered_load', 'Block probability for new call(dynamic queue)',data=df, marker='.', color='skyblue', linewidth=2)
-    plt.plot('Offered_load', 'Drop probability for handoff call(dynamic queue)',data=df, marker='.', color='red', linewidth=2)
-    plt.plot('Offered_load', 'Block probability for new call(FCFS queue)', data=df, marker='', color='blue', linewidth=2)
-    plt.plot('Offered_load', 'Drop probability for handoff call(FCFS queue)',data=df, marker='', color='orange', linewidth=2)
+    import matplotlib.pyplot as plt     # only paid for when plotting, prototype_test imports the model of this module
+    # plot straight from the arrays, every curve shares the lambda axis of the dynamic queue points
+    x = plot_data['Lambda_d']
+    plt.plot(x, plot_data['Pb_d'], label='Block probability for new call(dynamic queue)', marker='.', color='skyblue', linewidth=2)
+    plt.plot(x, plot_data['Ph_d'], label='Drop probability for handoff call(dynamic queue)', marker='.', color='red', linewidth=2)
+    plt.plot(x, plot_data['Pb_f'], label='Block probability for new call(FCFS queue)', marker='', color='blue', linewidth=2)
+    plt.plot(x, plot_data['Ph_f'], label='Drop probability for handoff call(FCFS queue)', marker='', color='orange', linewidth=2)
+    # analytical reference for the whole sweep in one vectorized recursion
+    plt.plot(x, erlang_b(N_Channels, offered_load(x, HANDOFF_TRAFFIC_RATIO, FastModel())),
+             label='Erlang-B blocking probability(no queue)', marker='', color='gray', linestyle='--', linewidth=1)
     plt.xlabel('lambda: call/min')
     plt.ylabel('probability')
     plt.legend()
     plt.show()
 
-def Simulation(lambd, plot_data, queue_type):
+def Simulation(lambd, queue_type, handoff_ratio, model, seed):
+    """
+    Simulate model.n_calls calls at arrival rate lambd, return the (blocking, dropping) probability.
+    Every parameter of the run comes from the arguments(model is a fast_sim.Model), none from the globals above.
+    """
 
-    system_performace_data = {'N_call': 0, 'H_call': 0, 'BN_call': 0, 'BH_call': 0, 
-                            'P1_call': 0, 'P2_call': 0, 'BP1_call': 0, 'BP2_call': 0, 'DP1_call': 0, 'DP2_call': 0}
+    # fixed-slot list indexed by the counters of fast_sim(N_CALL, H_CALL, ...), instead of a dict keyed by name
+    system_performace_data = [0] * N_STATS
 
-    random.seed(RANDOM_SEED)
+    sampler = Sampler(seed, model.n_calls)
     env = simpy.Environment()
-    BST = simpy.PriorityResource(env, capacity=N_Channels)
-    callSource = CallSource(env, N_CALLS, lambd, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO, BST, system_performace_data, queue_type)
+    BST = DualQueueResource(env, capacity=model.n_channels)
+    callSource = CallSource(env, lambd, handoff_ratio, model, sampler, BST, system_performace_data, CallParams(model, queue_type))
     env.process(callSource)
-    env.run()
-
-    if queue_type == 0:
-        plot_data["Lambda_d"].append(lambd)
-        plot_data['Pb_d'].append((system_performace_data['BN_call'] + system_performace_data['BP1_call'] + system_performace_data['BP2_call'])/ N_CALLS)
-        plot_data['Ph_d'].append(PRIORITY_1_RATIO * (system_performace_data['DP1_call'])/system_performace_data['H_call'] + (
-            1 - PRIORITY_1_RATIO) * (system_performace_data['DP2_call'])/system_performace_data['H_call'])
-    elif queue_type == 1:
-        plot_data["Lambda_f"].append(lambd)
-        plot_data['Pb_f'].append((system_performace_data['BN_call'] + system_performace_data['BP1_call'] + system_performace_data['BP2_call'])/ N_CALLS)
-        plot_data['Ph_f'].append(PRIORITY_1_RATIO * (system_performace_data['DP1_call'])/system_performace_data['H_call'] + (
-            1 - PRIORITY_1_RATIO) * (system_performace_data['DP2_call'])/system_performace_data['H_call'])
+    # SimPy allocates several short lived events per call that are freed by reference counting,
+    # the cyclic garbage collector is paused during the run and catches up once enabled again
+    gc.disable()
+    try:
+        env.run()
+    finally:
+        gc.enable()
+
+    return probabilities(system_performace_data, model)
+
+def CachedSimulation(lambd, queue_type, handoff_ratio, model, seed, code):
+    """
+    Simulation, with code(source_hash) only there to be part of the cache key: joblib hashes the code of
+    this wrapper alone, so the result of a point is reused only while every parameter it was simulated
+    with and the code of the model are the same.
+    """
+    return Simulation(lambd, queue_type, handoff_ratio, model, seed)
+
+def FastSimulation(lambd):
+    """
+    Same as Simulation, run by the numba compiled model of fast_sim.py without SimPy.
+    Every lambd(may be an array) is simulated in parallel under both queue schemes, REPLICATES times with
+    seeds spawned from RANDOM_SEED, the counters of the replicates are pooled before taking the rates.
+    Every lambd uses the same seeds, like Simulation. Returns the (blocking, dropping) probability arrays,
+    of shape lambd.shape + (2,) with the last axis indexed by queue_type.
+    """
+    lambd = np.asarray(lambd, dtype=np.float64)
+    model = FastModel()
+    seeds = np.random.SeedSequence(RANDOM_SEED).generate_state(REPLICATES).astype(np.int64)
+    n = lambd.size * REPLICATES
+    stats = run_sweep(np.full(n, HANDOFF_TRAFFIC_RATIO), np.repeat(lambd.ravel(), REPLICATES), np.tile(seeds, lambd.size), model)
+    Pb, Ph = probabilities(stats.reshape(lambd.size, REPLICATES, 2, N_STATS).sum(axis=1), model)
+    return Pb.reshape(lambd.shape + (2,)), Ph.reshape(lambd.shape + (2,))
+
+def FastModel():
+    # built on every call, so the global parameters above can still be changed at run time
+    return Model(N_CALLS, N_Channels, Q1_SIZE, Q2_SIZE, PRIORITY_1_RATIO, NEW_CALL_SERVICE_RATE, HANDOFF_CALL_SERVICE_RATE,
+                 P1CALL_DROP_RATE, P2CALL_DROP_RATE, TRANSITION_RATE)
 
 # Model components
-def CallSource(env, N_CALLS, LAMBD, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO, BST, system_performace_data, queue_type):
+def CallSource(env, LAMBD, HANDOFF_TRAFFIC_RATIO, model, sampler, BST, system_performace_data, call_params):
     """ 
-    Generates a sequence of new calls depends on HANDOFF_TRAFFIC_RATIO & PRIORITY_1_RATIO,
+    Generates a sequence of new calls depends on HANDOFF_TRAFFIC_RATIO & model.priority_1_ratio,
     In this case, HANDOFF_TRAFFIC_RATIO = 1/2, and PRIORITY_1_RATIO = 1/2, which means the handoff traffic is roughly  
     50% of the total in-comming call traffic, and among the total handoff traffic, calls that have priority 1 is roughly 50%. 
+    The call types and interarrival times of all model.n_calls calls are drawn up front in one NumPy batch
+    by sampler, the Sampler of the run. call_params is the CallParams table of the run.
     """
-    for i in range(N_CALLS):
-        p1 = random.random()
-        if p1 > HANDOFF_TRAFFIC_RATIO:
-            call = Call(
-                env, BST, 0, f"new call       , ID = {i}", system_performace_data, queue_type)
-            env.process(call)
-        else:
-            p2 = random.random()
-            if p2 > PRIORITY_1_RATIO:
-                call = Call(
-                    env, BST, 2, f"Priority 2 call, ID = {i}", system_performace_data, queue_type)
-                env.process(call)
-            else:
-                call = Call(
-                    env, BST, 1, f"Priority 1 call, ID = {i}", system_performace_data, queue_type)
-                env.process(call)
-        # t is the interarrival time, given the arrival rate is LAMBD
-        t = random.expovariate(LAMBD)
+    call_types, interarrival_times = sampler.draw_arrivals(model.n_calls, LAMBD, HANDOFF_TRAFFIC_RATIO, model.priority_1_ratio)
+    for i, (callType, t) in enumerate(zip(call_types, interarrival_times)):
+        Call(env, BST, callType, i, system_performace_data, call_params[callType], model, sampler)
         yield env.timeout(t)
 
 
-def Call(env, BST, callType, name, system_performace_data, queue_type):
+def Call(env, BST, callType, ID, system_performace_data, params, model, sampler):
     """
     Calls arrive at random at the BST(base station transmitter)
     , callType: 0 means new call, 1 means handoff call with priority 1, 2 means handoff call with priority 2.
-    queue_type = 0 => dynamic queue(Q1, Q2).
-    queue_type = 1 => FCFS queue(Q1, Q2), which means there is no dynamic flow from Q2 to Q1.
+    ID is the index of the call, its name is only built for tracing.
+    params is the CallParams row of callType, its queue_wait is how the call waits once queued.
+    model & sampler are the Model & Sampler of the run, handed on to the queue routines.
+    Admission is decided right away, a call that is served or blocked at arrival needs no process of
+    its own, only a queued call gets one.
     """
 
-    def LOG(message):
+    priority, service_rate, queue_size, call_count, block_count, queue_wait = params
+    name = None
+    if TRACING:
+        name = f"{CALL_NAMES[callType]}, ID = {ID}"
+        LOG(env, f"{name} Incoming")
+    if callType:
+        system_performace_data[H_CALL] += 1
+    system_performace_data[call_count] += 1
+
+    # a free channel is granted right away, the channel is released by a callback once the service is done
+    if BST.count < BST.capacity:
+        req = BST.request(priority=priority)
         if TRACING:
-            time = env.now
-            print(f"{time: 2f}: {message}")
+            LOG(env, f"{name} start: get a channel, being served...")
+        env.timeout(sampler.expovariate(service_rate)).callbacks.append(lambda _: Release(env, BST, req, name))
+        return
 
-    if callType == 0:
-        LOG(f"{name} Incoming")
-        system_performace_data['N_call'] += 1
+    if queue_wait is None or len(BST.queues[priority]) >= queue_size:
+        system_performace_data[block_count] += 1
+        if TRACING:
+            LOG(env, f"{name} get blocked, leaving system...")
+        return
 
-        req = BST.request(priority=3)
-        yield req | env.timeout(0)
-        if req.triggered:
-            LOG(f"{name} start: get a channel")
-            t = random.expovariate(NEW_CALL_SERVICE_RATE)
-            yield env.timeout(t)
-            BST.release(req)
-            LOG(f"{name} finish: leaving system...")
-        else:
-            req.cancel()
-            system_performace_data['BN_call'] += 1
-            LOG(f"{name} get blocked, leaving system...")
-
-    elif callType == 1:
-        LOG(f"{name} Incoming")
-        system_performace_data['H_call'] += 1
-        system_performace_data['P1_call'] += 1
-        total_service_time = random.expovariate(HANDOFF_CALL_SERVICE_RATE)
-        wait_time = random.expovariate(P1CALL_DROP_RATE)
-        req = BST.request(priority=0)
-        yield req | env.timeout(0)
-        if req.triggered:
-            LOG(f"{name} start: get a channel, being served...")
-            yield env.timeout(total_service_time)
-            BST.release(req)
-            LOG(f"{name} finish: leaving system...")
+    req = BST.request(priority=priority)
+    env.process(queue_wait(env, BST, name, system_performace_data, req, sampler.expovariate(service_rate), model, sampler))
+
+
+def Release(env, BST, req, name):
+    BST.release(req)
+    if TRACING:
+        LOG(env, f"{name} finish: leaving system...")
+
+
+def P1Queue(env, BST, name, system_performace_data, req, service_time, model, sampler):
+    """
+    Priority 1 call waiting in Q1, it gets dropped if no channel is free before its patience runs out.
+    """
+    yield req | env.timeout(sampler.expovariate(model.p1call_drop_rate))
+    if req.triggered:
+        if TRACING:
+            LOG(env, f"{name} start: get a channel(from Q1), being served...")
+        yield env.timeout(service_time)
+        if TRACING:
+            LOG(env, f"{name} finish: leaving system...")
+        BST.release(req)
+    else:
+        system_performace_data[DP1_CALL] += 1
+        req.cancel()
+        if TRACING:
+            LOG(env, f"{name} Q1 get dropped, leaving system...")
+
+
+def P2QueueDynamic(env, BST, name, system_performace_data, req, service_time, model, sampler):
+    """
+    Priority 2 call waiting in Q2 under the dynamic queue scheme, after transition_time it moves
+    into Q1 if Q1 has room, otherwise it keeps waiting in Q2 for the rest of its patience.
+    """
+    transition_time = sampler.expovariate(model.transition_rate)
+    t0 = env.now
+    yield req | env.timeout(transition_time)
+    if req.triggered:
+        if TRACING:
+            LOG(env, f"{name} start: get a channel(from Q2), being served...")
+        t1 = env.now
+        time_spent_in_queue = t1 - t0
+        service_time_left = max(
+            service_time - time_spent_in_queue, 0)
+        yield env.timeout(service_time_left)
+        BST.release(req)
+        if TRACING:
+            LOG(env, f"{name} finish: leaving system...")
+    elif len(BST.q1) < model.q1_size:
+        req.cancel()
+        new_req = BST.request(priority=0)
+        t = sampler.expovariate(model.p1call_drop_rate)
+        yield new_req | env.timeout(t)
+        if new_req.triggered:
+            if TRACING:
+                LOG(env, f"{name} start: get a channel(from Q1), being served...")
+            t_after = env.now
+            time_spent_in_queue = t_after - t0
+            service_time_left = max(service_time - time_spent_in_queue, 0)
+            yield env.timeout(service_time_left)
+            if TRACING:
+                LOG(env, f"{name} finish: leaving system...")
+            BST.release(new_req)
         else:
-            Q1Full = CountQueueLength(BST.queue, request_type=1)
-            if Q1Full:
-                system_performace_data['BP1_call'] += 1
-                req.cancel()
-                LOG(f"{name} Q1 full, blocked")
-            else:
-                yield req | env.timeout(wait_time)
-                if req.triggered:
-                    LOG(f"{name} start: get a channel(from Q1), being served...")
-                    yield env.timeout(total_service_time)
-                    LOG(f"{name} finish: leaving system...")
-                    BST.release(req)
-                else:
-                    system_performace_data['DP1_call'] += 1
-                    req.cancel()
-                    LOG(f"{name} Q1 get dropped, leaving system...")
-
-    # Priority 2 call
-    elif callType == 2:
-        LOG(f"{name} Incoming")
-        wait_time = random.expovariate(P2CALL_DROP_RATE)
-        transition_time = random.expovariate(TRANSITION_RATE)
-        service_time = random.expovariate(HANDOFF_CALL_SERVICE_RATE)
-
-        system_performace_data['H_call'] += 1
-        system_performace_data['P2_call'] += 1
-
-        req = BST.request(priority=1)
-        yield req | env.timeout(0)
+            new_req.cancel()
+            system_performace_data[DP1_CALL] += 1
+            if TRACING:
+                LOG(env, f"{name} Q1 get dropped, leaving system...")
+
+    else:
+        # the patience is only drawn once the transition failed
+        wait_time_left = max(sampler.expovariate(model.p2call_drop_rate) - transition_time, 0)
+        yield req | env.timeout(wait_time_left)
         if req.triggered:
-            LOG(f"{name} start: get a channel, being served...")
-            yield env.timeout(service_time)
+            if TRACING:
+                LOG(env, f"{name} start: get a channel(from Q2), being served...")
+            t2 = env.now
+            time_spent_in_queue = t2 - t0
+            service_time_left = max(
+                service_time - time_spent_in_queue, 0)
+            yield env.timeout(service_time_left)
+            if TRACING:
+                LOG(env, f"{name} finish: leaving system...")
             BST.release(req)
-            LOG(f"{name} finish: leaving system...")
         else:
-            Q2Full = CountQueueLength(BST.queue, request_type=2)
-            if Q2Full:
-                system_performace_data['BP2_call'] += 1
-                req.cancel()
-                LOG(f"{name} Q2 full, blocked")
-            else:
-                if queue_type == 0: # Dynanic 
-                    t0 = env.now
-                    yield req | env.timeout(transition_time)
-                    if req.triggered:
-                        LOG(f"{name} start: get a channel(from Q2), being served...")
-                        t1 = env.now
-                        time_spent_in_queue = t1 - t0
-                        service_time_left = max(
-                            service_time - time_spent_in_queue, 0)
-                        yield env.timeout(service_time_left)
-                        BST.release(req)
-                        LOG(f"{name} finish: leaving system...")
-                    else:
-                        p1Count = 0
-                        for request in BST.queue:
-                            if request.priority == 0:
-                                p1Count += 1
-                        if p1Count < Q1_SIZE:
-                            req.cancel()
-                            new_req = BST.request(priority=0)
-                            t = random.expovariate(P1CALL_DROP_RATE)
-                            yield new_req | env.timeout(t)
-                            if new_req.triggered:
-                                LOG(f"{name} start: get a channel(from Q1), being served...")
-                                t_after = env.now
-                                time_spent_in_queue = t_after - t0
-                                service_time_left = max(service_time - time_spent_in_queue, 0)
-                                yield env.timeout(service_time_left)
-                                LOG(f"{name} finish: leaving system...")
-                                BST.release(new_req)
-                            else:
-                                new_req.cancel()
-                                system_performace_data['DP1_call'] += 1
-                                LOG(f"{name} Q1 get dropped, leaving system...")
-
-                        else:
-                            wait_time_left = max(wait_time - transition_time, 0)
-                            yield req | env.timeout(wait_time_left)
-                            if req.triggered:
-                                LOG(f"{name} start: get a channel(from Q2), being served...")
-                                t2 = env.now
-                                time_spent_in_queue = t2 - t0
-                                service_time_left = max(
-                                    service_time - time_spent_in_queue, 0)
-                                yield env.timeout(service_time_left)
-                                LOG(f"{name} finish: leaving system...")
-                                BST.release(req)
-                            else:
-                                req.cancel()
-                                system_performace_data['DP2_call'] += 1
-                                LOG(f"{name}: Q2 get dropped")
-                else: # FCFS
-                    Q2_SIZE = CountQueueLength(BST.queue, request_type=2)
-                    if Q2_SIZE:
-                        system_performace_data['BP2_call'] += 1
-                        req.cancel()
-                        LOG(f"{name} Q2 full, blocked")
-                    else:
-                        yield req | env.timeout(random.expovariate(P2CALL_DROP_RATE))
-                        if req.triggered:
-                            LOG(f"{name} start: get a channel, being served...")
-                            yield env.timeout(random.expovariate(HANDOFF_CALL_SERVICE_RATE))
-                            LOG(f"{name} finish: leaving system...")
-                            BST.release(req)
-                        else:
-                            system_performace_data['DP2_call'] += 1
-                            req.cancel()
-                            LOG(f"{name} Q2 get dropped, leaving system...")
+            req.cancel()
+            system_performace_data[DP2_CALL] += 1
+            if TRACING:
+                LOG(env, f"{name}: Q2 get dropped")
+
+
+def P2QueueFCFS(env, BST, name, system_performace_data, req, service_time, model, sampler):
+    """
+    Priority 2 call waiting in Q2 under the FCFS queue scheme, no dynamic flow from Q2 to Q1.
+    """
+    yield req | env.timeout(sampler.expovariate(model.p2call_drop_rate))
+    if req.triggered:
+        if TRACING:
+            LOG(env, f"{name} start: get a channel, being served...")
+        yield env.timeout(service_time)
+        if TRACING:
+            LOG(env, f"{name} finish: leaving system...")
+        BST.release(req)
     else:
-        LOG("Something went wrong, unknown type of call.")
+        system_performace_data[DP2_CALL] += 1
+        req.cancel()
+        if TRACING:
+            LOG(env, f"{name} Q2 get dropped, leaving system...")
+
+
+class DualQueue:
+    """
+    Put queue of DualQueueResource, waiting requests are kept in one FIFO deque per priority:
+    q1(priority 0, Q1), q2(priority 1, Q2) and others(any other priority, Call never queues new calls).
+    Behaves like the SortedQueue of simpy.PriorityResource without re-sorting on every append,
+    and gives O(1) queue lengths. The deques are unbounded, Call checks whether Q1/Q2 is full
+    before queueing a request.
+    """
+
+    def __init__(self):
+        self.q1 = deque()
+        self.q2 = deque()
+        self.others = deque()
+        self._queues = (self.q1, self.q2, self.others)
+
+    def _queue(self, request):
+        return self._queues[min(request.priority, 2)]
+
+    def append(self, request):
+        self._queue(request).append(request)
+
+    def remove(self, request):
+        self._queue(request).remove(request)
+
+    def __len__(self):
+        return len(self.q1) + len(self.q2) + len(self.others)
+
+    def __iter__(self):
+        return itertools.chain(self.q1, self.q2, self.others)
+
+    def __getitem__(self, idx):
+        # simpy only looks at the head of the put queue
+        for queue in self._queues:
+            if idx < len(queue):
+                return queue[idx]
+            idx -= len(queue)
+        raise IndexError(idx)
+
+    def pop(self, idx):
+        request = self[idx]
+        self.remove(request)
+        return request
+
+
+class DualQueueResource(simpy.PriorityResource):
+    """
+    simpy.PriorityResource whose queue is a DualQueue, BST.q1 & BST.q2 are the waiting handoff requests.
+    """
+    PutQueue = DualQueue
+
+    @property
+    def q1(self):
+        return self.put_queue.q1
+
+    @property
+    def q2(self):
+        return self.put_queue.q2
+
+    @property
+    def queues(self):
+        # waiting requests indexed by priority
+        return self.put_queue._queues
+
+
+def CallParams(model, queue_type):
+    """
+    Per callType: (request priority, service rate, queue size, call counter, blocked counter, queue_wait),
+    so Call shares one code path for all three types of call. Built from the model of each run, like the
+    numba path, so changing the global parameters at run time applies to both.
+    queue_wait is how a queued call waits: None for new calls(never queued), P1Queue in Q1,
+    P2QueueDynamic => dynamic queue(Q1, Q2), P2QueueFCFS => FCFS queue(Q1, Q2), which means there is
+    no dynamic flow from Q2 to Q1. The Q2 strategy is picked once per simulation, so Call never branches on queue_type.
+    """
+    return (
+        (3, model.new_call_service_rate, 0, N_CALL, BN_CALL, None),                  # new call, never queued
+        (0, model.handoff_call_service_rate, model.q1_size, P1_CALL, BP1_CALL, P1Queue),
+        (1, model.handoff_call_service_rate, model.q2_size, P2_CALL, BP2_CALL, P2_QUEUE_IMPL[queue_type]),
+    )
+
+CALL_NAMES = ("new call       ", "Priority 1 call", "Priority 2 call")
+
+# Q2 waiting strategy, indexed by queue_type
+P2_QUEUE_IMPL = (P2QueueDynamic, P2QueueFCFS)
 
 
 # Utils
+# Tracing is checked at each call site, so the log message is never formatted when TRACING is off.
+def LOG(env, message):
+    print(f"{env.now: 2f}: {message}")
+
+class Sampler:
+    """
+    Random samples of one simulation, built by each run from its seed and passed down to CallSource, Call
+    & the queue routines, so runs never share a generator. It owns the np.random.Generator of the run and
+    a cache of pre-drawn exponential samples, one buffer per rate. The model only ever draws with a
+    handful of rates, so drawing them from NumPy in batches(of batch samples) and popping one at a time
+    is much cheaper than calling random.expovariate per event. CallSource draws the arrival process
+    from the same generator, in one batch before any of the buffers.
+    """
+
+    def __init__(self, seed, batch):
+        self.rng = np.random.default_rng(seed)
+        self.batch = batch
+        self._samples = {}
+
+    def draw_arrivals(self, n_calls, lambd, handoff_ratio, priority_1_ratio):
+        """
+        Call types(0 new call, 1 priority 1 & 2 priority 2 handoff call) and interarrival times of
+        n_calls calls, drawn in one batch. One uniform per call picks its type, same split as fast_sim._arrivals.
+        """
+        u = self.rng.random(n_calls)
+        call_types = np.where(u < handoff_ratio * priority_1_ratio, 1, np.where(u < handoff_ratio, 2, 0)).tolist()
+        # t is the interarrival time, given the arrival rate is lambd
+        interarrival_times = self.rng.exponential(1 / lambd, n_calls).tolist()
+        return call_types, interarrival_times
+
+    def expovariate(self, rate):
+        """
+        Drop-in replacement of random.expovariate, refills the buffer of the rate once it runs out.
+        """
+        try:
+            return next(self._samples[rate])
+        except (KeyError, StopIteration):
+            self._samples[rate] = iter(self.rng.exponential(1 / rate, self.batch).tolist())
+            return next(self._samples[rate])
+
+def source_hash():
+    """
+    Hash of the code a SimPy run depends on: the model components of this module, fast_sim.Model &
+    fast_sim.probabilities. main & the global parameters are left out, the parameters reach the cache
+    key through the arguments of CachedSimulation, so editing them only re-simulates the points they change.
+    """
+    sha = hashlib.sha1()
+    for code in (Simulation, CallSource, Call, Release, P1Queue, P2QueueDynamic, P2QueueFCFS, DualQueue,
+                 DualQueueResource, CallParams, Sampler, Model, probabilities):
+        sha.update(inspect.getsource(code).encode())
+    # the order of the Q2 strategies picks the one of each queue_type
+    sha.update(repr([wait.__name__ for wait in P2_QUEUE_IMPL]).encode())
+    return sha.hexdigest()
+
 # In this case: resource -> BST
 def print_stats(resource):
     print(f'{resource.count} of {resource.capacity} channels are allocated.')
     print(f'  Users: {resource.users}')
     print(f'  Queued events: {resource.queue}')
 
-"""
-This util function counts how many request currently holding onto resource(BST channels), 
-and return whether the desire queue is full. Ex: currently all K channels are full, then a priority 1 
-handoff call arrived, made a request to claim resource, then p1Count will equal 2(include himself), return False.
-"""
-def CountQueueLength(resourceQueue, request_type):
-    p1Count = p2Count = 0
-    for request in resourceQueue:
-        if request.priority == 0:
-            p1Count += 1
-        if request.priority == 1:
-            p2Count += 1
-    if request_type == 1:
-        return p1Count > Q1_SIZE
-    elif request_type == 2:
-        return p2Count > Q2_SIZE
-    else:
-        pass
-
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,144 @@
+""" analytic.py
+Analytical references plotted next to the simulated results.
+markov_chain solves the queueing model as a markov chain(checked by prototype_test.py), the sweeps of Simulation.py &
+Dropping_probability_diff.py are still simulated.
+"""
+
+import numpy as np
+
+
+def offered_load(lambd, handoff_ratio, model):
+    """
+    Offered traffic in Erlang, new calls and handoff calls have different mean holding times.
+    lambd & handoff_ratio may be arrays, model is a fast_sim.Model.
+    """
+    return lambd * ((1 - handoff_ratio) / model.new_call_service_rate + handoff_ratio / model.handoff_call_service_rate)
+
+
+def erlang_b(c, A):
+    """
+    Blocking probability of an M/M/c/c loss system offered A Erlang, by the recursion
+    B(0, A) = 1, B(k, A) = A * B(k-1, A) / (k + A * B(k-1, A)). A may be an array.
+    The reference of a cell with no handoff queue.
+    """
+    B = np.ones_like(A, dtype=np.float64)
+    for k in range(1, c + 1):
+        B = A * B / (k + A * B)
+    return B
+
+
+def markov_chain(lambd, handoff_ratio, model):
+    """
+    Steady state of the handoff model(dynamic queue scheme) as a continuous time markov chain, solved directly
+    instead of estimated by simulation. The chain follows the timing of fast_sim & the SimPy model:
+    - a priority 2 call in Q2 can only get dropped once its transition_time is over. If its patience ran out before,
+      it still moves into Q1 when Q1 has room and is dropped otherwise, else it waits in Q2 for the rest of its patience.
+    - the service time of a priority 2 call keeps running while it is queued(in Q2, then in Q1), a call whose service
+      time ran out before it gets a channel leaves right away and hands the channel on.
+    So every queued call carries its phase, and the queues are kept in FIFO order:
+    state (kn, kh, q1, q2), kn new calls & kh handoff calls in service, q1 a tuple of 'p'(priority 1 call),
+    'a' or 'd'(priority 2 call moved from Q2, with service time left or ran out), q2 a tuple of (phase, done),
+    phase 0 before the transition, 1 before the transition with the patience ran out, 2 after a failed transition,
+    done once the service time ran out. The queues are only non-empty when kn + kh == n_channels.
+    The number of states grows exponentially with q1_size & q2_size, fine for the small test set of prototype_test.py.
+    Builds the generator matrix Q over the states reachable from the empty cell and solves pi Q = 0, sum(pi) = 1.
+    Returns ({(k, m1, m2): probability}, blocking probability, dropping probability), k = kn + kh busy channels.
+    """
+    N, Q1, Q2 = model.n_channels, model.q1_size, model.q2_size
+    p1_ratio = model.priority_1_ratio
+    lambd_n = lambd * (1 - handoff_ratio)
+    lambd_p1 = lambd * handoff_ratio * p1_ratio
+    lambd_p2 = lambd * handoff_ratio * (1 - p1_ratio)
+    mu_n, mu_h = model.new_call_service_rate, model.handoff_call_service_rate
+    drop_1, drop_2, tau = model.p1call_drop_rate, model.p2call_drop_rate, model.transition_rate
+
+    def hand_over(kn, kh, q1, q2):
+        # a freed channel goes to the head of Q1 first, then Q2, a call whose service time ran out leaves right away
+        while q1 or q2:
+            if q1:
+                head, q1 = q1[0], q1[1:]
+                done = head == 'd'
+            else:
+                (_, done), q2 = q2[0], q2[1:]
+            if not done:
+                return (kn, kh + 1, q1, q2)
+        return (kn, kh, q1, q2)
+
+    def moves(s):
+        # (next state, rate, drop) of every transition out of s, drop 1/2: a call is dropped from Q1/Q2
+        kn, kh, q1, q2 = s
+        if kn + kh < N:
+            yield (kn + 1, kh, q1, q2), lambd_n, 0
+            yield (kn, kh + 1, q1, q2), lambd_p1 + lambd_p2, 0
+            if kn > 0:
+                yield (kn - 1, kh, q1, q2), kn * mu_n, 0
+            if kh > 0:
+                yield (kn, kh - 1, q1, q2), kh * mu_h, 0
+            return
+        if len(q1) < Q1:
+            yield (kn, kh, q1 + ('p',), q2), lambd_p1, 0
+        if len(q2) < Q2:
+            yield (kn, kh, q1, q2 + ((0, False),)), lambd_p2, 0
+        if kn > 0:
+            yield hand_over(kn - 1, kh, q1, q2), kn * mu_n, 0
+        if kh > 0:
+            yield hand_over(kn, kh - 1, q1, q2), kh * mu_h, 0
+        for i, call in enumerate(q1):
+            yield (kn, kh, q1[:i] + q1[i + 1:], q2), drop_1, 1
+            if call == 'a':
+                yield (kn, kh, q1[:i] + ('d',) + q1[i + 1:], q2), mu_h, 0
+        for i, (phase, done) in enumerate(q2):
+            rest = q2[:i] + q2[i + 1:]
+            if not done:
+                yield (kn, kh, q1, q2[:i] + ((phase, True),) + q2[i + 1:]), mu_h, 0
+            if phase == 2:
+                yield (kn, kh, q1, rest), drop_2, 2
+                continue
+            if phase == 0:
+                yield (kn, kh, q1, q2[:i] + ((1, done),) + q2[i + 1:]), drop_2, 0
+            # end of the transition_time
+            if len(q1) < Q1:
+                yield (kn, kh, q1 + ('d' if done else 'a',), rest), tau, 0
+            elif phase == 0:
+                yield (kn, kh, q1, q2[:i] + ((2, done),) + q2[i + 1:]), tau, 0
+            else:
+                yield (kn, kh, q1, rest), tau, 2
+
+    empty = (0, 0, (), ())
+    states, index = [empty], {empty: 0}
+    for s in states:    # grows while it is walked, every reachable state is visited once
+        for dst, _, _ in moves(s):
+            if dst not in index:
+                index[dst] = len(states)
+                states.append(dst)
+
+    Q = np.zeros((len(states), len(states)))
+    drops = np.zeros((len(states), 3))     # rate of the transitions dropping a call, by drop
+    for i, s in enumerate(states):
+        for dst, r, drop in moves(s):
+            Q[i, index[dst]] += r
+            drops[i, drop] += r
+    np.fill_diagonal(Q, 0)
+    np.fill_diagonal(Q, -Q.sum(axis=1))
+
+    A = np.vstack([Q.T, np.ones(len(states))])
+    b = np.zeros(len(states) + 1)
+    b[-1] = 1
+    pi = np.linalg.lstsq(A, b, rcond=None)[0]
+
+    # by PASTA, an arrival sees the steady state
+    k = np.array([s[0] + s[1] for s in states])
+    m1 = np.array([len(s[2]) for s in states])
+    m2 = np.array([len(s[3]) for s in states])
+    full = k == N
+    Blocking_p = ((1 - handoff_ratio) * pi[full].sum() + handoff_ratio * (
+        p1_ratio * pi[full & (m1 == Q1)].sum() + (1 - p1_ratio) * pi[full & (m2 == Q2)].sum()))
+    # drops per handoff arrival, weighted the same way as the simulation
+    lambd_h = lambd * handoff_ratio
+    Dropping_p = (p1_ratio * (pi @ drops[:, 1]) + (1 - p1_ratio) * (pi @ drops[:, 2])) / lambd_h
+
+    steady_state = {}
+    for state, p in zip(states, pi):
+        key = (state[0] + state[1], len(state[2]), len(state[3]))
+        steady_state[key] = steady_state.get(key, 0) + p
+    return dict(sorted(steady_state.items())), Blocking_p, Dropping_p
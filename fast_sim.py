@@ -0,0 +1,287 @@
+""" fast_sim.py
+Next-event simulation of the handoff model of Simulation.py, compiled by numba.
+Same model as Simulation.Call, without SimPy: Simulation.py & Dropping_probability_diff.py use it for their sweeps,
+the SimPy model is kept as the readable reference.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from numba import njit, prange, typeof, types
+
+
+class Model(namedtuple('Model', ['n_calls', 'n_channels', 'q1_size', 'q2_size', 'priority_1_ratio',
+                                 'new_call_service_rate', 'handoff_call_service_rate',
+                                 'p1call_drop_rate', 'p2call_drop_rate', 'transition_rate'])):
+    """
+    Model parameters, built by each script from its own global parameters so editing them there still applies.
+    Sizes are cast to int and rates to float, so the kernels below always see the one type they are compiled for.
+    """
+    __slots__ = ()
+
+    def __new__(cls, n_calls, n_channels, q1_size, q2_size, priority_1_ratio, new_call_service_rate,
+                handoff_call_service_rate, p1call_drop_rate, p2call_drop_rate, transition_rate):
+        return super().__new__(cls, int(n_calls), int(n_channels), int(q1_size), int(q2_size), float(priority_1_ratio),
+                               float(new_call_service_rate), float(handoff_call_service_rate),
+                               float(p1call_drop_rate), float(p2call_drop_rate), float(transition_rate))
+
+
+# numba type of Model, used in the explicit signatures so run_states & run_sweep compile(or load from cache) at import
+# instead of on the first call
+MODEL_TYPE = typeof(Model(1, 1, 1, 1, 0, 0, 0, 0, 0, 0))
+
+# Index of each counter in the statistics array returned by _simulate
+N_CALL, H_CALL, BN_CALL, BH_CALL, P1_CALL, P2_CALL, BP1_CALL, BP2_CALL, DP1_CALL, DP2_CALL = range(10)
+N_STATS = 10
+
+# Columns of the Q1 & Q2 arrays, one row per queued call
+END = 0             # time of the next event of the call: drop deadline, or Q2 -> Q1 transition
+SERVICE = 1         # service time of the call
+T0 = 2              # time the priority 2 call entered Q2, -1 means the call gets its full service time
+PENDING = 3         # 1 while the Q2 -> Q1 transition of the call is pending, 0 once it has happened or under FCFS(Q2 only)
+
+
+def probabilities(stats, model):
+    """
+    (blocking, dropping) probability from the counters of one simulation(_simulate), stats may also be the
+    array of run_sweep or run_states, or any array with the counters along its last axis. Counters summed over replicates
+    give the pooled estimate, every rate is taken over the calls actually counted.
+    """
+    stats = np.asarray(stats)
+    Pb = (stats[..., BN_CALL] + stats[..., BP1_CALL] + stats[..., BP2_CALL]) / (stats[..., N_CALL] + stats[..., H_CALL])
+    Ph = model.priority_1_ratio * stats[..., DP1_CALL] / stats[..., H_CALL] + (
+        1 - model.priority_1_ratio) * stats[..., DP2_CALL] / stats[..., H_CALL]
+    return Pb, Ph
+
+
+# Helpers come first, the explicit signatures below compile the kernels as soon as they are defined
+@njit(cache=True)
+def _arrivals(handoff_ratio, lambd, model):
+    """
+    Draw the whole arrival process up front in one batch: same split as CallSource, 0 new call,
+    1 priority 1 handoff call, 2 priority 2 handoff call, and the interarrival time after each call.
+    One uniform per call picks its type: [0, handoff_ratio * priority_1_ratio) priority 1,
+    [.., handoff_ratio) priority 2, the rest new calls.
+    """
+    u = np.random.random(model.n_calls)
+    call_types = np.where(u < handoff_ratio * model.priority_1_ratio, 1, np.where(u < handoff_ratio, 2, 0))
+    # t is the interarrival time, given the arrival rate is lambd
+    interarrival_times = np.random.exponential(1 / lambd, model.n_calls)
+    return call_types, interarrival_times
+
+
+@njit(cache=True)
+def _seize(channel_end, t):
+    # caller checked that a channel is idle, return the channel seized
+    for c in range(channel_end.size):
+        if channel_end[c] == np.inf:
+            channel_end[c] = t
+            return c
+    return -1
+
+
+@njit(cache=True)
+def _service_left(call, now):
+    # priority 2 calls keep the service time left after the time spent in queue
+    if call[T0] < 0:
+        return call[SERVICE]
+    return max(call[SERVICE] - (now - call[T0]), 0)
+
+
+@njit(cache=True)
+def _remove(queue, n, i):
+    # remove row i, keeping the FIFO order, return the new queue length
+    for j in range(i, n - 1):
+        queue[j] = queue[j + 1]
+    return n - 1
+
+
+@njit(cache=True)
+def _draw(handoff_ratio, lambd, seed, model):
+    """
+    The arrival process of seed, plus the seed of the service, patience & transition times drawn
+    while simulating it. Both queue schemes of a point replay the same arrivals and the same event
+    stream, so their difference is not blurred by sampling noise(common random numbers).
+    """
+    np.random.seed(seed)
+    call_types, interarrival_times = _arrivals(handoff_ratio, lambd, model)
+    return call_types, interarrival_times, np.random.randint(0, 2**31 - 1)
+
+
+@njit(cache=True)
+def _simulate(call_types, interarrival_times, queue_type, model, state_count):
+    """
+    The future event list is kept in fixed size arrays: the service completion time of every channel,
+    the pending deadline of every queued call, and the next arrival. Each step scans them for the
+    earliest event, n_channels + q1_size + q2_size slots is small enough that this beats a heap.
+    Arrivals before the next departure or deadline are handled in a batch after one scan.
+    Q1 is always drained before Q2.
+    queue_type = 0 => dynamic queue(Q1, Q2).
+    queue_type = 1 => FCFS queue(Q1, Q2), which means there is no dynamic flow from Q2 to Q1.
+    Unless state_count is empty, state_count[k, m1, m2] counts the arrivals that saw k busy channels,
+    m1 calls in Q1 & m2 calls in Q2.
+    """
+
+    stats = np.zeros(N_STATS, dtype=np.int64)
+    # mean of every exponential draw, computed once per run instead of once per event
+    new_scale = 1 / model.new_call_service_rate
+    handoff_scale = 1 / model.handoff_call_service_rate
+    p1_drop_scale = 1 / model.p1call_drop_rate
+    p2_drop_scale = 1 / model.p2call_drop_rate
+    transition_scale = 1 / model.transition_rate
+    channel_end = np.full(model.n_channels, np.inf)     # inf: channel is idle
+    busy = 0
+    q1 = np.empty((model.q1_size, 3))                   # FIFO, only the first n1 rows are in use
+    q2 = np.empty((model.q2_size, 4))
+    n1 = n2 = 0
+
+    next_arrival = 0.0
+    n_arrivals = 0
+    while True:
+        # find the earliest departure or queue deadline
+        horizon = np.inf
+        kind = 0    # 1: departure, 2: Q1 deadline, 3: Q2 deadline
+        idx = 0
+        for c in range(model.n_channels):
+            if channel_end[c] < horizon:
+                horizon, kind, idx = channel_end[c], 1, c
+        for i in range(n1):
+            if q1[i, END] < horizon:
+                horizon, kind, idx = q1[i, END], 2, i
+        for i in range(n2):
+            if q2[i, END] < horizon:
+                horizon, kind, idx = q2[i, END], 3, i
+
+        # every arrival up to the horizon is handled in one batch, without scanning the channels & queues again,
+        # only a call that gets a channel or enters a queue can move the horizon earlier
+        while n_arrivals < model.n_calls and next_arrival <= horizon:
+            now = next_arrival
+            if state_count.size:
+                state_count[busy, n1, n2] += 1
+            call_type = call_types[n_arrivals]
+            next_arrival = now + interarrival_times[n_arrivals]
+            n_arrivals += 1
+
+            if call_type == 0:
+                stats[N_CALL] += 1
+                if busy < model.n_channels:
+                    busy += 1
+                    c = _seize(channel_end, now + np.random.exponential(new_scale))
+                    if channel_end[c] < horizon:
+                        horizon, kind, idx = channel_end[c], 1, c
+                else:
+                    stats[BN_CALL] += 1
+
+            elif call_type == 2:
+                stats[H_CALL] += 1
+                stats[P2_CALL] += 1
+                # only draw the times a branch uses, a blocked call needs none of them
+                if busy < model.n_channels:
+                    busy += 1
+                    c = _seize(channel_end, now + np.random.exponential(handoff_scale))
+                    if channel_end[c] < horizon:
+                        horizon, kind, idx = channel_end[c], 1, c
+                elif n2 >= model.q2_size:
+                    stats[BP2_CALL] += 1
+                else:
+                    q2[n2, SERVICE] = np.random.exponential(handoff_scale)
+                    if queue_type == 0: # Dynamic, the patience is only drawn if the transition fails
+                        q2[n2, END] = now + np.random.exponential(transition_scale)
+                        q2[n2, T0] = now
+                        q2[n2, PENDING] = 1
+                    else: # FCFS
+                        q2[n2, END] = now + np.random.exponential(p2_drop_scale)
+                        q2[n2, T0] = -1
+                        q2[n2, PENDING] = 0
+                    if q2[n2, END] < horizon:
+                        horizon, kind, idx = q2[n2, END], 3, n2
+                    n2 += 1
+
+            else:
+                stats[H_CALL] += 1
+                stats[P1_CALL] += 1
+                if busy < model.n_channels:
+                    busy += 1
+                    c = _seize(channel_end, now + np.random.exponential(handoff_scale))
+                    if channel_end[c] < horizon:
+                        horizon, kind, idx = channel_end[c], 1, c
+                elif n1 >= model.q1_size:
+                    stats[BP1_CALL] += 1
+                else:
+                    q1[n1, SERVICE] = np.random.exponential(handoff_scale)
+                    q1[n1, END] = now + np.random.exponential(p1_drop_scale)
+                    q1[n1, T0] = -1
+                    if q1[n1, END] < horizon:
+                        horizon, kind, idx = q1[n1, END], 2, n1
+                    n1 += 1
+
+        if horizon == np.inf:
+            break
+        now = horizon
+
+        if kind == 1:
+            # the channel is handed over to the head of Q1, or else Q2
+            if n1 > 0:
+                channel_end[idx] = now + _service_left(q1[0], now)
+                n1 = _remove(q1, n1, 0)
+            elif n2 > 0:
+                channel_end[idx] = now + _service_left(q2[0], now)
+                n2 = _remove(q2, n2, 0)
+            else:
+                channel_end[idx] = np.inf
+                busy -= 1
+
+        elif kind == 2:
+            stats[DP1_CALL] += 1
+            n1 = _remove(q1, n1, idx)
+
+        elif q2[idx, PENDING] == 0:
+            stats[DP2_CALL] += 1
+            n2 = _remove(q2, n2, idx)
+
+        elif n1 < model.q1_size:
+            # transition from Q2 into Q1 with a fresh Q1 deadline
+            q1[n1, END] = now + np.random.exponential(p1_drop_scale)
+            q1[n1, SERVICE] = q2[idx, SERVICE]
+            q1[n1, T0] = q2[idx, T0]
+            n1 += 1
+            n2 = _remove(q2, n2, idx)
+
+        else:
+            # Q1 full, stay in Q2 for the rest of the patience, which started when the call entered Q2
+            q2[idx, END] = now + max(np.random.exponential(p2_drop_scale) - (now - q2[idx, T0]), 0)
+            q2[idx, PENDING] = 0
+
+    return stats
+
+
+@njit(types.Tuple((types.int64[:, :], types.int64[:, :, :, :]))(types.float64, types.float64, types.int64, types.int64[:],
+                                                                 MODEL_TYPE), parallel=True, cache=True)
+def run_states(handoff_ratio, lambd, queue_type, seeds, model):
+    """
+    One independent replicate per seed, in parallel, each drawn & simulated like a point of run_sweep. Returns the counters of each replicate,
+    stats[i], and the number of arrivals of replicate i that saw each state (k, m1, m2), state_count[i, k, m1, m2].
+    """
+    stats = np.empty((seeds.size, N_STATS), dtype=np.int64)
+    state_count = np.zeros((seeds.size, model.n_channels + 1, model.q1_size + 1, model.q2_size + 1), dtype=np.int64)
+    for i in prange(seeds.size):
+        call_types, interarrival_times, event_seed = _draw(handoff_ratio, lambd, seeds[i], model)
+        np.random.seed(event_seed)
+        stats[i] = _simulate(call_types, interarrival_times, queue_type, model, state_count[i])
+    return stats, state_count
+
+
+@njit(types.int64[:, :, :](types.float64[:], types.float64[:], types.int64[:], MODEL_TYPE), parallel=True, cache=True)
+def run_sweep(handoff_ratios, lambdas, seeds, model):
+    """
+    One independent point per seed, each simulated under both queue schemes from a single draw of its
+    arrival process. stats[i, queue_type] holds the counters of point i.
+    """
+    stats = np.empty((seeds.size, 2, N_STATS), dtype=np.int64)
+    for i in prange(seeds.size):
+        call_types, interarrival_times, event_seed = _draw(handoff_ratios[i], lambdas[i], seeds[i], model)
+        for queue_type in range(2):
+            np.random.seed(event_seed)
+            stats[i, queue_type] = _simulate(call_types, interarrival_times, queue_type, model,
+                                             np.zeros((0, 0, 0), dtype=np.int64))
+    return stats
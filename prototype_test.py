@@ -3,13 +3,17 @@ Perform model checking for mmcc.py by running code on a small test set, and veri
 by compare the program outcome with the math result computed by hand using 2-class markov chain model.
 The test set contains only 2 channels, and the queue size for Q1 & Q2 are both 1.
 The state diagram, global balance equation, and steady state probability is presented in: https://hackmd.io/Wen6lG5RTxmwrPxWDrCUKw
+analytic.markov_chain solves the chain numerically, with the P2 drop & service timing of the simulation, its result
+is printed next to the simulation outcome and each value passes if the two are within TOLERANCE standard errors.
+The simulation is the numba model of fast_sim.py, SIMPY_REFERENCE = True checks the SimPy model instead.
 """
 
+import sys
 import simpy
-import random
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
+from Simulation import DualQueueResource, LOG, CALL_NAMES, Sampler
+from analytic import markov_chain
+from fast_sim import Model, run_states, probabilities, N_STATS, N_CALL, H_CALL, BN_CALL, P1_CALL, P2_CALL, BP1_CALL, BP2_CALL, DP1_CALL, DP2_CALL
 
 # Global Parameter
 RANDOM_SEED = 3                                               # for result's reproducibility
@@ -26,210 +30,247 @@ Q1_SIZE = 1                                                   # number of priori
 Q2_SIZE = 1                                                   # number of priority two call that can be queued in Q2
 N_CALLS = 10000                                               # number of calls to simulate
 TRACING = False                                               # Simulation Logging
+SIMPY_REFERENCE = False                                       # True: check the SimPy model instead of the numba one in fast_sim.py
+TOLERANCE = 3                                                 # largest accepted gap between a simulated & analytic value, in standard errors
+REPLICATES = 16                                               # independent runs pooled by the check, at least 2 for a standard error
 
 
 def main():
-    
-    system_performace_data = {'N_call': 0, 'H_call': 0, 'BN_call': 0, 'BH_call': 0,
-                            'P1_call': 0, 'P2_call': 0, 'BP1_call': 0, 'BP2_call': 0, 'DP1_call': 0, 'DP2_call': 0,
-                            (0,0,0):0, (1,0,0):0, (2,0,0):0, (2,1,0):0, (2,0,1):0, (2,1,1):0}
 
-    random.seed(RANDOM_SEED)
+    model = FastModel()
+    # REPLICATES independent runs of the same model, dynamic queue scheme
+    seeds = np.random.SeedSequence(RANDOM_SEED).generate_state(REPLICATES).astype(np.int64)
+    if SIMPY_REFERENCE:
+        runs = [Simulation(seed) for seed in seeds]
+        # laid out like the arrays of run_states
+        stats, state_count = np.array([run[0] for run in runs]), np.array([run[1] for run in runs])
+    else:
+        stats, state_count = run_states(HANDOFF_TRAFFIC_RATIO, LAMBD, 0, seeds, model)
+
+    # pooled over the replicates with the standard error across them, passes within TOLERANCE standard errors,
+    # every failed check is kept in failures
+    failures = []
+    def Estimate(samples, pooled, analytic, label):
+        se = samples.std(ddof=1) / np.sqrt(len(samples))
+        verdict = "pass" if abs(pooled - analytic) <= TOLERANCE * se else "FAIL"
+        if verdict == "FAIL":
+            failures.append(label)
+        return f"{pooled:.6f} ± {se:.6f} / {analytic:.6f} {verdict}"
+
+    Blocking_p, Dropping_p = probabilities(stats.sum(axis=0), model)
+    Blocking_r, Dropping_r = probabilities(stats, model)
+    steady_state, Blocking_a, Dropping_a = markov_chain(LAMBD, HANDOFF_TRAFFIC_RATIO, model)
+
+    print(f"Steady state probability: (simulation / markov chain), {len(stats)} replicate(s)")
+    for state in steady_state:
+        samples = state_count[(slice(None),) + state] / N_CALLS
+        print(f"{state}: {Estimate(samples, samples.mean(), steady_state[state], state)}")
+    print("------------------------------------\n")
+    print("System average statistics: (simulation / markov chain)")
+    print(f"Blocking probability: {Estimate(Blocking_r, Blocking_p, Blocking_a, 'blocking probability')}")
+    print(f"Handoff dropping probability: {Estimate(Dropping_r, Dropping_p, Dropping_a, 'dropping probability')}")
+    # a failed check fails the run, so a script or CI running the check sees it
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed: {', '.join(map(str, failures))}")
+
+
+def Simulation(seed):
+    """
+    Run the SimPy model from seed, return its counters(indexed by N_CALL, H_CALL, ... of fast_sim, same layout
+    as Simulation.py) & state_count, the number of arrivals that saw each state (k, m1, m2).
+    """
+    system_performace_data = [0] * N_STATS
+    state_count = np.zeros((N_Channels + 1, Q1_SIZE + 1, Q2_SIZE + 1), dtype=np.int64)
+
+    # every sample comes from a batched NumPy Sampler of Simulation.py, owned by this run
+    sampler = Sampler(seed, N_CALLS)
     env = simpy.Environment()
-    BST = simpy.PriorityResource(env, capacity=N_Channels)
-    callSource = CallSource(env, N_CALLS, LAMBD, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO, BST, system_performace_data)
+    BST = DualQueueResource(env, capacity=N_Channels)
+    callSource = CallSource(env, N_CALLS, LAMBD, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO, BST, system_performace_data, state_count,
+                            sampler)
     env.process(callSource)
     env.run()
+    return system_performace_data, state_count
 
-    Dropping_p = (PRIORITY_1_RATIO * (system_performace_data['DP1_call'] / system_performace_data['H_call'])) + ((1 - PRIORITY_1_RATIO) * (system_performace_data["DP2_call"] / system_performace_data["H_call"]))
 
-    print(f"Steady state probability: ")
-    print(f"(0,0,0): {system_performace_data[(0,0,0)] / N_CALLS}")
-    print(f"(1,0,0): {system_performace_data[(1,0,0)] / N_CALLS}")
-    print(f"(2,0,0): {system_performace_data[(2,0,0)] / N_CALLS}")
-    print(f"(2,0,1): {system_performace_data[(2,0,1)] / N_CALLS}")
-    print(f"(2,1,0): {system_performace_data[(2,1,0)] / N_CALLS}")
-    print(f"(2,1,1): {system_performace_data[(2,1,1)] / N_CALLS}")
-    print("------------------------------------\n")
-    print("System average statistics: ")
-    print(f"Blocking probability: {(system_performace_data['BN_call'] + system_performace_data['BP1_call'] + system_performace_data['BP2_call'])/ N_CALLS}")
-    print(f"Handoff dropping probability: {Dropping_p}")
+def FastModel():
+    return Model(N_CALLS, N_Channels, Q1_SIZE, Q2_SIZE, PRIORITY_1_RATIO, NEW_CALL_SERVICE_RATE, HANDOFF_CALL_SERVICE_RATE,
+                 P1CALL_DROP_RATE, P2CALL_DROP_RATE, TRANSITION_RATE)
+
 
 # Model components 
-def CallSource(env, N_CALLS, LAMBD, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO, BST, system_performace_data):
+def CallSource(env, N_CALLS, LAMBD, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO, BST, system_performace_data, state_count, sampler):
     """ 
     Generates a sequence of new calls depends on HANDOFF_TRAFFIC_RATIO & PRIORITY_1_RATIO,
     In this case, HANDOFF_TRAFFIC_RATIO = 1/2, and PRIORITY_1_RATIO = 1/2, which means the handoff traffic is roughly  
     50% of the total in-comming call traffic, and among the total handoff traffic, calls that have priority 1 is roughly 50%. 
+    The call types and interarrival times of all N_CALLS calls are drawn up front in one NumPy batch by sampler,
+    the Sampler of the run, which Call draws its service, patience & transition times from.
     """
 
-    for i in range(N_CALLS):
-        p1 = random.random()
-        if p1 > HANDOFF_TRAFFIC_RATIO:
-            call = Call(env, BST, 0, f"new call       , ID = {i}", system_performace_data)
-            env.process(call)
-        else:
-            p2 = random.random()
-            if p2 > PRIORITY_1_RATIO:
-                call = Call(env, BST, 2, f"Priority 2 call, ID = {i}", system_performace_data)
-                env.process(call)
-            else:
-                call = Call(env, BST, 1, f"Priority 1 call, ID = {i}", system_performace_data)
-                env.process(call)
-        # t is the interarrival time, given the arrival rate is LAMBD
-        t = random.expovariate(LAMBD)
+    call_types, interarrival_times = sampler.draw_arrivals(N_CALLS, LAMBD, HANDOFF_TRAFFIC_RATIO, PRIORITY_1_RATIO)
+    for i, (callType, t) in enumerate(zip(call_types, interarrival_times)):
+        call = Call(env, BST, callType, i, system_performace_data, state_count, sampler)
+        env.process(call)
         yield env.timeout(t)
 
 
-def Call(env, BST, callType, name, system_performace_data):
+def Call(env, BST, callType, ID, system_performace_data, state_count, sampler):
     """
     Calls arrive at random at the BST(base station transmitter)
     , callType: 0 means new call, 1 means handoff call with priority 1, 2 means handoff call with priority 2.
     queue_type = 0 => dynamic queue(Q1, Q2).
     queue_type = 1 => FCFS queue(Q1, Q2), which means there is no dynamic flow from Q2 to Q1.
+    ID is the index of the call, its name is only built for tracing.
     """
 
-    def LOG(message):
-        if TRACING:
-            time = env.now
-            print(f"{time: 2f}: {message}")
-    
+    name = None
+    if TRACING:
+        name = f"{CALL_NAMES[callType]}, ID = {ID}"
+
     # Statistics, observe system at each arrival
     # By PASTA property of Poisson process, what each arrival observe
     # is the system average statistics
-    k = BST.count
-    m1 = m2 = 0
-    for request in BST.queue:
-        if request.priority == 0:
-            m1 += 1
-        if request.priority == 1:
-            m2 += 1
-    system_performace_data[(k, m1, m2)] += 1
+    state_count[BST.count, len(BST.q1), len(BST.q2)] += 1
 
     if callType == 0:
-        LOG(f"{name} Incoming")
-        system_performace_data['N_call'] += 1
+        if TRACING:
+            LOG(env, f"{name} Incoming")
+        system_performace_data[N_CALL] += 1
 
-        req = BST.request(priority=3)
-        yield req | env.timeout(0)
-        if req.triggered:
-            LOG(f"{name} start: get a channel")
-            t = random.expovariate(NEW_CALL_SERVICE_RATE)
+        if BST.count < BST.capacity:    # a free channel is granted right away
+            req = BST.request(priority=3)
+            yield req
+            if TRACING:
+                LOG(env, f"{name} start: get a channel")
+            t = sampler.expovariate(NEW_CALL_SERVICE_RATE)
             yield env.timeout(t)
             BST.release(req)
-            LOG(f"{name} finish: leaving system...")
+            if TRACING:
+                LOG(env, f"{name} finish: leaving system...")
         else:
-            req.cancel()
-            system_performace_data['BN_call'] += 1
-            LOG(f"{name} get blocked, leaving system...")
+            system_performace_data[BN_CALL] += 1
+            if TRACING:
+                LOG(env, f"{name} get blocked, leaving system...")
 
     elif callType == 1:
-        LOG(f"{name} Incoming")
-        system_performace_data['H_call'] += 1
-        system_performace_data['P1_call'] += 1
-        total_service_time = random.expovariate(HANDOFF_CALL_SERVICE_RATE)
-        wait_time = random.expovariate(P1CALL_DROP_RATE)
-        req = BST.request(priority=0)
-        yield req | env.timeout(0)
-        if req.triggered:
-            LOG(f"{name} start: get a channel, being served...")
-            yield env.timeout(total_service_time)
+        if TRACING:
+            LOG(env, f"{name} Incoming")
+        system_performace_data[H_CALL] += 1
+        system_performace_data[P1_CALL] += 1
+        if BST.count < BST.capacity:    # a free channel is granted right away
+            req = BST.request(priority=0)
+            yield req
+            if TRACING:
+                LOG(env, f"{name} start: get a channel, being served...")
+            yield env.timeout(sampler.expovariate(HANDOFF_CALL_SERVICE_RATE))
             BST.release(req)
-            LOG(f"{name} finish: leaving system...")
+            if TRACING:
+                LOG(env, f"{name} finish: leaving system...")
+        elif len(BST.q1) >= Q1_SIZE:
+            system_performace_data[BP1_CALL] += 1
+            if TRACING:
+                LOG(env, f"{name} Q1 full, blocked")
         else:
-            Q1Full = CountQueueLength(BST.queue, request_type=1)
-            if Q1Full:
-                system_performace_data['BP1_call'] += 1
-                req.cancel()
-                LOG(f"{name} Q1 full, blocked")
+            total_service_time = sampler.expovariate(HANDOFF_CALL_SERVICE_RATE)
+            wait_time = sampler.expovariate(P1CALL_DROP_RATE)
+            req = BST.request(priority=0)
+            yield req | env.timeout(wait_time)
+            if req.triggered:
+                if TRACING:
+                    LOG(env, f"{name} start: get a channel(from Q1), being served...")
+                yield env.timeout(total_service_time)
+                if TRACING:
+                    LOG(env, f"{name} finish: leaving system...")
+                BST.release(req)
             else:
-                yield req | env.timeout(wait_time)
-                if req.triggered:
-                    LOG(f"{name} start: get a channel(from Q1), being served...")
-                    yield env.timeout(total_service_time)
-                    LOG(f"{name} finish: leaving system...")
-                    BST.release(req)
-                else:
-                    system_performace_data['DP1_call'] += 1
-                    req.cancel()
-                    LOG(f"{name} Q1 get dropped, leaving system...")
+                system_performace_data[DP1_CALL] += 1
+                req.cancel()
+                if TRACING:
+                    LOG(env, f"{name} Q1 get dropped, leaving system...")
 
     # Priority 2 call
     elif callType == 2:
-        LOG(f"{name} Incoming")
-        wait_time = random.expovariate(P2CALL_DROP_RATE)
-        transition_time = random.expovariate(TRANSITION_RATE)
-        service_time = random.expovariate(HANDOFF_CALL_SERVICE_RATE)
-
-        system_performace_data['H_call'] += 1
-        system_performace_data['P2_call'] += 1
+        if TRACING:
+            LOG(env, f"{name} Incoming")
+        system_performace_data[H_CALL] += 1
+        system_performace_data[P2_CALL] += 1
 
-        req = BST.request(priority=1)
-        yield req | env.timeout(0)
-        if req.triggered:
-            LOG(f"{name} start: get a channel, being served...")
-            yield env.timeout(service_time)
+        if BST.count < BST.capacity:    # a free channel is granted right away
+            req = BST.request(priority=1)
+            yield req
+            if TRACING:
+                LOG(env, f"{name} start: get a channel, being served...")
+            yield env.timeout(sampler.expovariate(HANDOFF_CALL_SERVICE_RATE))
             BST.release(req)
-            LOG(f"{name} finish: leaving system...")
+            if TRACING:
+                LOG(env, f"{name} finish: leaving system...")
+        elif len(BST.q2) >= Q2_SIZE:
+            system_performace_data[BP2_CALL] += 1
+            if TRACING:
+                LOG(env, f"{name} Q2 full, blocked")
         else:
-            Q2Full = CountQueueLength(BST.queue, request_type=2)
-            if Q2Full:
-                system_performace_data['BP2_call'] += 1
-                req.cancel()
-                LOG(f"{name} Q2 full, blocked")
+            # only a queued call needs its transition time, and its wait time only once the transition failed
+            transition_time = sampler.expovariate(TRANSITION_RATE)
+            service_time = sampler.expovariate(HANDOFF_CALL_SERVICE_RATE)
+            req = BST.request(priority=1)
+            t0 = env.now
+            yield req | env.timeout(transition_time)
+            if req.triggered:
+                if TRACING:
+                    LOG(env, f"{name} start: get a channel(from Q2), being served...")
+                t1 = env.now
+                time_spent_in_queue = t1 - t0
+                service_time_left = max(service_time - time_spent_in_queue, 0)
+                yield env.timeout(service_time_left)
+                BST.release(req)
+                if TRACING:
+                    LOG(env, f"{name} finish: leaving system...")
             else:
-                t0 = env.now
-                yield req | env.timeout(transition_time)
-                if req.triggered:
-                    LOG(f"{name} start: get a channel(from Q2), being served...")
-                    t1 = env.now
-                    time_spent_in_queue = t1 - t0
-                    service_time_left = max(service_time - time_spent_in_queue, 0)
-                    yield env.timeout(service_time_left)
-                    BST.release(req)
-                    LOG(f"{name} finish: leaving system...")
-                else:
-                    p1Count = 0
-                    for request in BST.queue:
-                        if request.priority == 0:
-                            p1Count += 1
-                    if p1Count < Q1_SIZE:
-                        req.cancel()
-                        new_req = BST.request(priority=0)
-                        t = random.expovariate(P1CALL_DROP_RATE)
-                        yield new_req | env.timeout(t)
-                        if new_req.triggered:
-                            LOG(f"{name} start: get a channel(from Q1), being served...")
-                            t_after = env.now
-                            time_spent_in_queue = t_after - t0
-                            service_time_left = max(service_time - time_spent_in_queue, 0)
-                            yield env.timeout(service_time_left)
-                            LOG(f"{name} finish: leaving system...")
-                            BST.release(new_req)
-                        else:
-                            new_req.cancel()
-                            system_performace_data['DP1_call'] += 1
-                            LOG(f"{name} Q1 get dropped, leaving system...")
+                if len(BST.q1) < Q1_SIZE:
+                    req.cancel()
+                    new_req = BST.request(priority=0)
+                    t = sampler.expovariate(P1CALL_DROP_RATE)
+                    yield new_req | env.timeout(t)
+                    if new_req.triggered:
+                        if TRACING:
+                            LOG(env, f"{name} start: get a channel(from Q1), being served...")
+                        t_after = env.now
+                        time_spent_in_queue = t_after - t0
+                        service_time_left = max(service_time - time_spent_in_queue, 0)
+                        yield env.timeout(service_time_left)
+                        if TRACING:
+                            LOG(env, f"{name} finish: leaving system...")
+                        BST.release(new_req)
+                    else:
+                        new_req.cancel()
+                        system_performace_data[DP1_CALL] += 1
+                        if TRACING:
+                            LOG(env, f"{name} Q1 get dropped, leaving system...")
 
+                else:
+                    wait_time_left = max(sampler.expovariate(P2CALL_DROP_RATE) - transition_time, 0)
+                    yield req | env.timeout(wait_time_left)
+                    if req.triggered:
+                        if TRACING:
+                            LOG(env, f"{name} start: get a channel(from Q2), being served...")
+                        t2 = env.now
+                        time_spent_in_queue = t2 - t0
+                        service_time_left = max(
+                                service_time - time_spent_in_queue, 0)
+                        yield env.timeout(service_time_left)
+                        if TRACING:
+                            LOG(env, f"{name} finish: leaving system...")
+                        BST.release(req)
                     else:
-                        wait_time_left = max(wait_time - transition_time, 0)
-                        yield req | env.timeout(wait_time_left)
-                        if req.triggered:
-                            LOG(f"{name} start: get a channel(from Q2), being served...")
-                            t2 = env.now
-                            time_spent_in_queue = t2 - t0
-                            service_time_left = max(
-                                    service_time - time_spent_in_queue, 0)
-                            yield env.timeout(service_time_left)
-                            LOG(f"{name} finish: leaving system...")
-                            BST.release(req)
-                        else:
-                            req.cancel()
-                            system_performace_data['DP2_call'] += 1
-                            LOG(f"{name}: Q2 get dropped")
+                        req.cancel()
+                        system_performace_data[DP2_CALL] += 1
+                        if TRACING:
+                            LOG(env, f"{name}: Q2 get dropped")
                 
     else:
-        LOG("Something went wrong, unknown type of call.")
+        if TRACING:
+            LOG(env, "Something went wrong, unknown type of call.")
 
 
 # Utils
@@ -240,27 +281,5 @@ def print_stats(resource):
     print(f'  Queued events: {resource.queue}')
 
 
-"""
-This util function counts how many request currently holding onto resource(BST channels), 
-and return whether the desire queue is full. Ex: currently all K channels are full, then a priority 1 
-handoff call arrived, made a request to claim resource, then p1Count will equal 2(include himself), return False.
-"""
-
-
-def CountQueueLength(resourceQueue, request_type):
-    p1Count = p2Count = 0
-    for request in resourceQueue:
-        if request.priority == 0:
-            p1Count += 1
-        if request.priority == 1:
-            p2Count += 1
-    if request_type == 1:
-        return p1Count > Q1_SIZE
-    elif request_type == 2:
-        return p2Count > Q2_SIZE
-    else:
-        pass
-
-
 if __name__ == '__main__':
     main()